@@ -1,21 +1,228 @@
-from typing import Annotated, List
+from typing import Annotated, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple, Union
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from bisect import bisect_left
+from itertools import accumulate, islice, repeat
+from operator import add
 from semantic_kernel.functions import kernel_function
-from pymongo import MongoClient
-import PyPDF2
+from gridfs import AsyncGridFSBucket
+from plugins.db import CATEGORY_COLLATION, ensure_indexes, get_client
+import pypdfium2 as pdfium
+import asyncio
+import heapq
 import os
+import re
+import threading
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# Query words up to this length are matched exactly rather than as substrings.
+_MAX_EXACT_WORD_LEN = 2
+
+# Serialises every call into PDFium, which must not be entered from two threads at once.
+_PDFIUM_LOCK = threading.Lock()
+
+@lru_cache(maxsize=256)
+def _tokenize(query: str) -> FrozenSet[str]:
+    """Lowercased tokens of a query; cached because the model often repeats a search."""
+    # Single characters are elision and punctuation debris ("l'", "what's",
+    # "art.1") rather than search terms.
+    return frozenset(token for token in _TOKEN_RE.findall(query.lower()) if len(token) > 1)
+
+def _extract_page_text(pdf: pdfium.PdfDocument, page_num: int) -> str:
+    """Extract the text of a single page, releasing the native handles afterwards."""
+    # Lenient like a non-strict reader: a page PDFium cannot load or decode
+    # yields no text instead of failing the whole document.
+    try:
+        page = pdf[page_num]
+    except pdfium.PdfiumError:
+        return ""
+    try:
+        textpage = page.get_textpage()
+        try:
+            return textpage.get_text_range()
+        finally:
+            textpage.close()
+    except pdfium.PdfiumError:
+        return ""
+    finally:
+        page.close()
+
+class _PDFIndex:
+    """Overlapping chunks of a PDF's text plus an inverted index over their tokens."""
+    
+    def __init__(self, chunk_size: int = 1000):
+        self.chunk_size = chunk_size
+        self.num_pages = 0
+        self.chunks: Tuple[dict, ...] = ()
+        self.total_chars = 0
+        self._postings: Dict[str, Dict[int, int]] = {}
+    
+    def _index_chunk(self, chunk_id: int, chunk_lower: str):
+        """Add the tokens of an already lowercased chunk to the inverted index."""
+        for token, count in Counter(_TOKEN_RE.findall(chunk_lower)).items():
+            self._postings.setdefault(token, {})[chunk_id] = count
+    
+    def _stream_chunks(self, pages: Iterable[str]) -> Iterator[dict]:
+        """Split page texts into overlapping chunks as the pages arrive, keeping only the current chunk in memory."""
+        chunk_id = 0
+        current_chunk = []
+        current_lower = []
+        # ends[i] is the running size up to and including current_chunk[i], each
+        # word counted with its trailing space; base is the size before
+        # current_chunk[0]. Both persist across pages so the carried-over words
+        # are never re-measured.
+        ends = []
+        base = 0
+        lo = 0
+        
+        for page_text in pages:
+            # Lowercase each page once; carried-over words are not lowered again.
+            page_words = page_text.split()
+            current_chunk += page_words
+            current_lower += page_text.lower().split()
+            
+            # Extending the running sizes with accumulate and locating chunk
+            # boundaries with bisect keeps the per-word work in C; Python only
+            # steps once per emitted chunk.
+            ends += islice(accumulate(map(add, map(len, page_words), repeat(1)), initial=ends[-1] if ends else base), 1, None)
+            start = 0
+            
+            while True:
+                end = bisect_left(ends, base + self.chunk_size, lo)
+                if end == len(ends):
+                    break
+                
+                chunk_text = ' '.join(current_chunk[start:end + 1])
+                self._index_chunk(chunk_id, ' '.join(current_lower[start:end + 1]))
+                chunk_id += 1
+                yield {
+                    'text': chunk_text,
+                    'size': len(chunk_text)
+                }
+                # The last 100 words carry over into the next chunk.
+                new_start = max(start, end + 1 - 100)
+                if new_start > start:
+                    base = ends[new_start - 1]
+                    start = new_start
+                lo = end + 1
+            
+            del current_chunk[:start]
+            del current_lower[:start]
+            del ends[:start]
+            lo -= start
+        
+        if current_chunk:
+            chunk_text = ' '.join(current_chunk)
+            self._index_chunk(chunk_id, ' '.join(current_lower))
+            yield {
+                'text': chunk_text,
+                'size': len(chunk_text)
+            }
+    
+    def build(self, pages: Iterable[str]):
+        """Chunk and index the given page texts, replacing any previous content."""
+        self._postings = {}
+        self.chunks = tuple(self._stream_chunks(pages))
+        self.total_chars = sum(chunk['size'] for chunk in self.chunks)
+    
+    def search(self, query: str, limit: int = 3) -> List[Tuple[dict, int]]:
+        """Returns up to `limit` (chunk, score) pairs, best first."""
+        query_words = _tokenize(query)
+        
+        # Very short words (e.g. "l" from "l'auto", "s" from "what's") would be
+        # a substring of almost every token, so they only match exactly.
+        matched_chunks = {
+            word: set(self._postings.get(word, ()))
+            for word in query_words
+            if len(word) <= _MAX_EXACT_WORD_LEN
+        }
+        substring_words = [word for word in query_words if len(word) > _MAX_EXACT_WORD_LEN]
+        for word in substring_words:
+            matched_chunks[word] = set()
+        
+        # One pass over the document vocabulary matches every longer query
+        # word at once, so partial words (e.g. "deduct") still hit "deductible"
+        # without rescanning the chunk texts.
+        if substring_words:
+            for token, chunk_counts in self._postings.items():
+                for word in substring_words:
+                    if word in token:
+                        matched_chunks[word].update(chunk_counts)
+        
+        scores = Counter()
+        for chunk_ids in matched_chunks.values():
+            scores.update(chunk_ids)
+        
+        # Ties go to the earlier chunk, so results follow document order.
+        top = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [(self.chunks[chunk_id], score) for chunk_id, score in top]
+
+def _file_mtime(path: Optional[str]) -> Optional[float]:
+    """Returns the modification time of path, or None if it is missing or unreadable."""
+    if not path:
+        return None
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+# Indexes of recently loaded PDFs, least recently used first. Only touched
+# from the event loop, so it needs no lock.
+_INDEX_CACHE: "OrderedDict[tuple, _PDFIndex]" = OrderedDict()
+_INDEX_CACHE_SIZE = 8
+
+def _cached_index(key: tuple) -> Optional[_PDFIndex]:
+    """Returns the cached index for key, marking it as recently used."""
+    index = _INDEX_CACHE.get(key)
+    if index is not None:
+        _INDEX_CACHE.move_to_end(key)
+    return index
+
+def _cache_index(key: tuple, index: _PDFIndex):
+    """Stores an index, evicting the least recently used one when full."""
+    _INDEX_CACHE[key] = index
+    _INDEX_CACHE.move_to_end(key)
+    while len(_INDEX_CACHE) > _INDEX_CACHE_SIZE:
+        _INDEX_CACHE.popitem(last=False)
+
+def _build_index(source: Union[str, bytes], chunk_size: int) -> _PDFIndex:
+    """Extract, chunk and index a PDF given as a file path or as its raw bytes."""
+    index = _PDFIndex(chunk_size)
+    # PDFium is not thread-safe, even across different documents, so pages
+    # are extracted sequentially and concurrent loads (e.g. parallel tool
+    # calls running on the default thread pool) take turns on _PDFIUM_LOCK.
+    # A per-page thread pool was tried with PyPDF2 and rejected: its pure
+    # Python extraction holds the GIL, and each worker re-parsed the whole
+    # PDF, so loads got slower rather than faster.
+    # The per-page work already runs in native code. A path is opened by
+    # PDFium itself and bytes are read in place, so the document is never
+    # copied into another Python buffer.
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(source)
+        try:
+            index.num_pages = len(pdf)
+            index.build(
+                f"[Page {page_num + 1}] {_extract_page_text(pdf, page_num)}"
+                for page_num in range(index.num_pages)
+            )
+        finally:
+            pdf.close()
+    return index
 
 class conditions_plugin:
     def __init__(self):
-        self.pdf_chunks = []
+        self._index: Optional[_PDFIndex] = None
         self.pdf_filename = ""
         self.loaded = False
         self.chunk_size = 1000
         self.client = None
         self.db = None
         self.conditions_collection = None
+        self.fs = None
         self.connected = False
     
-    def _connect(self):
+    async def _connect(self):
         """Internal method to establish database connection."""
         if self.connected:
             return True
@@ -25,87 +232,70 @@ class conditions_plugin:
             if not connection_string:
                 return False
             
-            self.client = MongoClient(connection_string)
-            self.client.admin.command('ping')
+            self.client = get_client(connection_string)
+            await self.client.admin.command('ping')
             
             self.db = self.client[os.getenv("DB_NAME")]
             self.conditions_collection = self.db["policy_conditions"]
+            self.fs = AsyncGridFSBucket(self.db)
+            await ensure_indexes(self.db)
             self.connected = True
             return True
         except Exception as e:
             self.connected = False
             return False
     
-    def _chunk_text(self, text: str) -> List[dict]:
-        """Split text into overlapping chunks for better context."""
-        chunks = []
-        words = text.split()
-        current_chunk = []
-        current_size = 0
-        
-        for word in words:
-            current_chunk.append(word)
-            current_size += len(word) + 1
-            
-            if current_size >= self.chunk_size:
-                chunk_text = ' '.join(current_chunk)
-                chunks.append({
-                    'text': chunk_text,
-                    'size': len(chunk_text)
-                })
-                current_chunk = current_chunk[-100:]
-                current_size = sum(len(w) + 1 for w in current_chunk)
-        
-        if current_chunk:
-            chunks.append({
-                'text': ' '.join(current_chunk),
-                'size': len(' '.join(current_chunk))
-            })
-        
-        return chunks
-    
     @kernel_function(
         name="load_conditions_by_category",
         description="Loads insurance policy conditions PDF from storage based on the policy category (e.g., Auto, Casa, Infortuni). Retrieves the document from database storage and prepares it for analysis.",
     )
-    def load_conditions_by_category(
+    async def load_conditions_by_category(
         self,
         category: Annotated[str, "The insurance policy category (e.g., Car, Injuries, Home)"],
     ) -> str:
         """Loads conditions PDF from database storage by category."""
-        if not self._connect():
+        if not await self._connect():
             return "Error: Cannot connect to database. Please check your MongoDB connection string."
         
         try:
-            result = self.conditions_collection.find_one({
-                "category": {"$regex": f"^{category}$", "$options": "i"}
-            })
+            result = await self.conditions_collection.find_one(
+                {"category": category},
+                collation=CATEGORY_COLLATION
+            )
             
             if not result:
                 return f"No conditions found for category '{category}'. Available categories can be checked in the database."
             
+            file_id = result.get("file_id")
             storage_url = result.get("storage_url")
             conditions_name = result.get("name_conditions", "Unknown")
             
-            if not storage_url or not os.path.exists(storage_url):
-                return f"Conditions '{conditions_name}' found but PDF file not accessible at: {storage_url}"
+            # GridFS files are immutable, so their id alone identifies the
+            # content; files on disk are keyed on mtime to pick up replacements.
+            if file_id is not None:
+                key = ("gridfs", file_id, self.chunk_size)
+            else:
+                mtime = _file_mtime(storage_url)
+                if mtime is None:
+                    return f"Conditions '{conditions_name}' found but PDF file not accessible at: {storage_url}"
+                key = (storage_url, mtime, self.chunk_size)
             
-            with open(storage_url, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                num_pages = len(pdf_reader.pages)
-                
-                full_text = []
-                for page_num in range(num_pages):
-                    page = pdf_reader.pages[page_num]
-                    page_text = page.extract_text()
-                    full_text.append(f"[Page {page_num + 1}] {page_text}")
-                
-                combined_text = "\n".join(full_text)
-                self.pdf_chunks = self._chunk_text(combined_text)
-                self.pdf_filename = conditions_name
-                self.loaded = True
-                
-                return f"Successfully loaded conditions: {conditions_name} ({num_pages} pages, {len(self.pdf_chunks)} chunks). Ready for analysis!"
+            index = _cached_index(key)
+            if index is None:
+                if file_id is not None:
+                    grid_out = await self.fs.open_download_stream(file_id)
+                    source = await grid_out.read()
+                else:
+                    source = storage_url
+                # Extraction is blocking native work; run it off the event loop.
+                index = await asyncio.to_thread(_build_index, source, self.chunk_size)
+                _cache_index(key, index)
+            
+            self._index = index
+            self.pdf_filename = conditions_name
+            self.loaded = True
+            
+            return f"Successfully loaded conditions: {conditions_name} ({self._index.num_pages} pages, {len(self._index.chunks)} chunks). Ready for analysis!"
         
         except Exception as e:
             return f"Error loading conditions: {str(e)}"
@@ -122,34 +312,17 @@ class conditions_plugin:
         if not self.loaded:
             return "No conditions loaded. Please use load_conditions_by_category first to load a policy conditions document."
         
-        query_lower = query.lower()
-        query_words = set(query_lower.split())
-        
-        scored_chunks = []
-        for idx, chunk in enumerate(self.pdf_chunks):
-            chunk_lower = chunk['text'].lower()
-            
-            matches = sum(1 for word in query_words if word in chunk_lower)
-            
-            if matches > 0:
-                scored_chunks.append({
-                    'index': idx,
-                    'score': matches,
-                    'text': chunk['text']
-                })
-        
-        scored_chunks.sort(key=lambda x: x['score'], reverse=True)
-        top_chunks = scored_chunks[:3]
+        top_chunks = self._index.search(query)
         
         if not top_chunks:
             return f"No relevant content found for '{query}' in {self.pdf_filename}"
         
-        result = f"Found {len(top_chunks)} relevant section(s) in {self.pdf_filename}:\n\n"
-        for i, chunk in enumerate(top_chunks, 1):
-            result += f"--- Section {i} (Relevance: {chunk['score']} matches) ---\n"
-            result += chunk['text'] + "\n\n"
+        parts = [f"Found {len(top_chunks)} relevant section(s) in {self.pdf_filename}:\n\n"]
+        for i, (chunk, score) in enumerate(top_chunks, 1):
+            parts.append(f"--- Section {i} (Relevance: {score} matches) ---\n")
+            parts.append(chunk['text'] + "\n\n")
         
-        return result
+        return "".join(parts)
     
     @kernel_function(
         name="get_pdf_info",
@@ -160,6 +333,4 @@ class conditions_plugin:
         if not self.loaded:
             return "No PDF currently loaded."
         
-        total_chars = sum(chunk['size'] for chunk in self.pdf_chunks)
-        
-        return f"PDF Information:\n- Filename: {self.pdf_filename}\n- Chunks: {len(self.pdf_chunks)}\n- Total characters: {total_chars}\n- Status: Loaded and ready\n- Tip: Use search_pdf_content to find relevant sections efficiently"
+        return f"PDF Information:\n- Filename: {self.pdf_filename}\n- Chunks: {len(self._index.chunks)}\n- Total characters: {self._index.total_chars}\n- Status: Loaded and ready\n- Tip: Use search_pdf_content to find relevant sections efficiently"
@@ -0,0 +1,30 @@
+from functools import lru_cache
+from pymongo import AsyncMongoClient
+import os
+
+# Case-insensitive comparison, so category lookups can use an index instead of a regex scan.
+CATEGORY_COLLATION = {"locale": "en", "strength": 2}
+
+@lru_cache(maxsize=1)
+def get_client(connection_string: str) -> AsyncMongoClient:
+    """Returns the AsyncMongoClient shared by all plugins, creating it on first use."""
+    return AsyncMongoClient(connection_string, maxPoolSize=50, minPoolSize=5)
+
+async def ensure_indexes(db):
+    """Creates the indexes the plugins query with, best-effort."""
+    # Indexes only speed lookups up, so a failure (e.g. a read-only user) must
+    # not make the database look unreachable; queries still work without them.
+    try:
+        # Named explicitly so it can coexist with a plain "category_1" index.
+        await db["policy_conditions"].create_index(
+            [("category", 1)],
+            name="category_case_insensitive",
+            collation=CATEGORY_COLLATION
+        )
+    except Exception:
+        pass
+    
+    try:
+        await db[os.getenv("COLLECTIONS")].create_index([("expiration_date", 1)])
+    except Exception:
+        pass
@@ -1,9 +1,12 @@
 from typing import Annotated
 from semantic_kernel.functions import kernel_function
-from pymongo import MongoClient
+from plugins.db import CATEGORY_COLLATION, ensure_indexes, get_client
 from datetime import datetime
 import os
 
+# Fields rendered by list_all_insurances; everything else is left on the server.
+LISTED_FIELDS = ("policy_holder", "policy_type", "provider", "guarantees", "expiration_date", "conditions")
+
 class insurance_position_plugin:
     def __init__(self):
         self.client = None
@@ -12,7 +15,7 @@ class insurance_position_plugin:
         self.conditions_collection = None
         self.connected = False
     
-    def _connect(self):
+    async def _connect(self):
         """Internal method to establish database connection."""
         if self.connected:
             return True
@@ -22,27 +25,29 @@ class insurance_position_plugin:
             if not connection_string:
                 return False
             
-            self.client = MongoClient(connection_string)
-            self.client.admin.command('ping')
+            self.client = get_client(connection_string)
+            await self.client.admin.command('ping')
             
             self.db = self.client[os.getenv("DB_NAME")]
             self.collection = self.db[os.getenv("COLLECTIONS")]
             self.conditions_collection = self.db["policy_conditions"]
+            await ensure_indexes(self.db)
             self.connected = True
             return True
         except Exception as e:
             self.connected = False
             return False
     
-    def _get_conditions_by_category(self, category: str) -> str:
+    async def _get_conditions_by_category(self, category: str) -> str:
         """Internal method to get conditions from database by category."""
-        if not self._connect():
+        if not await self._connect():
             return ""
         
         try:
-            result = self.conditions_collection.find_one({
-                "category": {"$regex": f"^{category}$", "$options": "i"}
-            })
+            result = await self.conditions_collection.find_one(
+                {"category": category},
+                collation=CATEGORY_COLLATION
+            )
             if result and "name_conditions" in result:
                 return result["name_conditions"]
             return ""
@@ -53,15 +58,15 @@ class insurance_position_plugin:
         name="get_next_policy_exp",
         description="Gets the next insurance expiration date from the database. Returns the insurance policy that will expire soonest.",
     )
-    def get_next_expire(self) -> str:
+    async def get_next_expire(self) -> str:
         """Gets the next insurance expiration date."""
-        if not self._connect():
+        if not await self._connect():
             return "Error: Cannot connect to database. Please check your MongoDB connection string in the .env file."
         
         try:
             current_date = datetime.now()
             
-            result = self.collection.find_one(
+            result = await self.collection.find_one(
                 {"expiration_date": {"$gte": current_date}},
                 sort=[("expiration_date", 1)]
             )
@@ -87,18 +92,23 @@ class insurance_position_plugin:
         name="list_all_insurances",
         description="Lists all insurance policies in the database with their expiration dates and their guarantees.",
     )
-    def list_all_insurances(self) -> str:
+    async def list_all_insurances(self) -> str:
         """Lists all insurance policies."""
-        if not self._connect():
+        if not await self._connect():
             return "Error: Cannot connect to database. Please check your MongoDB connection string."
         
         try:
-            insurances = list(self.collection.find().sort("expiration_date", 1))
+            cursor = self.collection.find(
+                {},
+                {field: 1 for field in LISTED_FIELDS}
+            ).sort("expiration_date", 1).batch_size(100)
+            insurances = await cursor.to_list()
             
             if not insurances:
                 return "No insurance policies found in the database."
             
-            result = f"Found {len(insurances)} insurance policies:\n\n"
+            parts = [f"Found {len(insurances)} insurance policies:\n\n"]
+            now = datetime.now()
             
             for idx, ins in enumerate(insurances, 1):
                 policy_holder = ins.get('policy_holder', 'Unknown')
@@ -110,19 +120,21 @@ class insurance_position_plugin:
                 
                 if isinstance(exp_date, datetime):
                     exp_str = exp_date.strftime('%Y-%m-%d')
-                    days_until = (exp_date - datetime.now()).days
+                    days_until = (exp_date - now).days
                     status = "Expired" if days_until < 0 else f"{days_until} days left"
                 else:
                     exp_str = str(exp_date)
                     status = "Unknown"
                 
-                result += f"{idx}. {policy_holder} ({policy_type})\n"
-                result += f"   Provider: {provider}\n"
-                result += f"   Guarantees: {guarantees}\n"
-                result += f"   Expires: {exp_str} ({status})\n"
-                result += f"   Conditions: {conditions}\n/n"
+                parts.append(
+                    f"{idx}. {policy_holder} ({policy_type})\n"
+                    f"   Provider: {provider}\n"
+                    f"   Guarantees: {guarantees}\n"
+                    f"   Expires: {exp_str} ({status})\n"
+                    f"   Conditions: {conditions}\n\n"
+                )
             
-            return result
+            return "".join(parts)
         
         except Exception as e:
             return f"Error listing insurances: {str(e)}"
@@ -131,7 +143,7 @@ class insurance_position_plugin:
         name="add_insurance",
         description="Adds a new insurance policy to the database. Requires policy holder, type, provider, guarantees and expiration date (YYYY-MM-DD format).",
     )
-    def add_insurance(
+    async def add_insurance(
         self,
         policy_holder: Annotated[str, "Name of the insurance policy holder"],
         policy_type: Annotated[str, "Type of insurance (e.g., Car, Injuries, Home)"],
@@ -140,13 +152,13 @@ class insurance_position_plugin:
         expiration_date: Annotated[str, "Expiration date in YYYY-MM-DD format"],
     ) -> str:
         """Adds a new insurance policy to the database."""
-        if not self._connect():
+        if not await self._connect():
             return "Error: Cannot connect to database. Please check your MongoDB connection string."
         
         try:
             exp_date = datetime.strptime(expiration_date, "%Y-%m-%d")
             
-            conditions = self._get_conditions_by_category(policy_type)
+            conditions = await self._get_conditions_by_category(policy_type)
             
             insurance_doc = {
                 "policy_holder": policy_holder,
@@ -158,7 +170,7 @@ class insurance_position_plugin:
                 "created_at": datetime.now()
             }
             
-            result = self.collection.insert_one(insurance_doc)
+            result = await self.collection.insert_one(insurance_doc)
             
             return f"Successfully added insurance policy for '{policy_holder}' with conditions {conditions} (ID: {result.inserted_id})"
         
@@ -171,13 +183,13 @@ class insurance_position_plugin:
         name="get_db_status",
         description="Returns the connection status and basic information about the insurance database.",
     )
-    def get_db_status(self) -> str:
+    async def get_db_status(self) -> str:
         """Returns database connection status and info."""
-        if not self._connect():
+        if not await self._connect():
             return "Database Status: Not Connected\nPlease check your MONGODB_CONNECTION_STRING in the .env file."
         
         try:
-            count = self.collection.count_documents({})
+            count = await self.collection.count_documents({})
             return f"Database Status: Connected\nDatabase: insurance_db\nCollection: insurances\nTotal policies: {count}"
         except Exception as e:
             return f"Database Status: Connected but error occurred: {str(e)}"